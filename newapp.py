@@ -1,448 +1,726 @@
-import streamlit as st
-import pandas as pd
-from newats_engine import (
-    rank_candidates,
-    generate_compliant_feedback,
-    extract_text_from_pdf,
-    extract_text_from_docx,
-    clean_and_structure_resume,
-    compute_fit_score,
-    rewrite_resume,
-    client,  # reuse OpenAI client from ats_engine
-)
-
-# ==============================
-# LOGIN MOCK FOR PROTOTYPE
-# ==============================
-
-def login_mock():
-    """
-    Temporary login for prototype.
-    Replace later with real auth (e.g. SSO).
-    """
-    st.title("Login to Compliant ATS")
-    st.write("Use this simple login while prototyping.")
-
-    role = st.radio("I am logging in as:", ["Recruiter", "Applicant"])
-    user_name = st.text_input("Your name")
-
-    if st.button("Continue"):
-        if not user_name.strip():
-            st.error("Please enter a name.")
-        else:
-            st.session_state.auth = {
-                "is_authenticated": True,
-                "user_name": user_name.strip(),
-                "role": role,
-            }
-            st.success(f"Welcome, {user_name.strip()}! Logged in as {role}.")
-            st.rerun()
-
-
-# ==============================
-# APPLICANT LIST FEEDBACK HELPER
-# ==============================
-
-def generate_rejection_email(job_description: str, cleaned_resume: str, candidate_name: str = "the candidate") -> str:
-    """
-    Generates a fully formatted, legally compliant rejection email
-    based on JD + cleaned resume content.
-    """
-    
-    system_prompt = """
-    You are an Expert Resume Consultant and Compliance Officer. 
-    Your job is to generate a *polite, professional rejection email* that is fully legally compliant.
-
-    ⚠️ Your output MUST ALWAYS be a COMPLETE EMAIL.  
-    ⚠️ NOT a list.  
-    ⚠️ NOT bullet points alone.  
-    ⚠️ NOT freeform commentary.  
-    Only a polished email with the structure below.
-
-    ------------------------------------------
-    EMAIL FORMAT (YOU MUST FOLLOW THIS EXACTLY)
-    ------------------------------------------
-
-    Subject: Feedback on Your Application
-
-    Hi [Candidate Name],
-
-    Thank the candidate sincerely for applying.  
-    Explain that after reviewing their application in relation to the job description, 
-    the company will not be moving forward.  
-    Keep the tone neutral, factual, and professional.
-
-    Then provide TWO SECTIONS:
-
-    ### 🔎 Key Areas of Alignment
-    • 2–3 bullet points listing the candidate’s strengths that *directly match the job description*.
-
-    ### 🎯 Key Areas to Strengthen
-    • 5–7 bullet points describing hard-skill or experience gaps that prevented progression.
-    • Reference only skills, tools, systems, technical depth, demonstrated experience, 
-      or missing measurable outcomes.
-    • Be specific, factual, and based ONLY on the resume + job description.
-
-    Closing paragraph:
-    Thank them again for their interest.  
-    Wish them success in their job search.  
-    Sign off as “HR Team”.
-
-    ------------------------------------------
-    LEGAL COMPLIANCE RULES (MANDATORY)
-    ------------------------------------------
-    - DO NOT mention personality, attitude, soft skills, or cultural fit.
-    - DO NOT reference protected traits (gender, age, race, health, etc).
-    - DO NOT speculate about ability or experience.
-    - ONLY refer to job-related, demonstrable hard skills or experience.
-    """
-
-    user_prompt = f"""
-    Candidate Name: {candidate_name}
-
-    Job Description:
-    {job_description}
-
-    Cleaned Resume:
-    {cleaned_resume}
-
-    Write the rejection email following the exact required format.
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.0  # deterministic, consistent output
-    )
-
-    return response.choices[0].message.content
-
-
-
-# ==============================
-# PAGE CONFIG
-# ==============================
-
-st.set_page_config(page_title="Compliant ATS Prototype", layout="wide")
-
-
-# ==============================
-# AUTH INITIALISATION
-# ==============================
-
-if "auth" not in st.session_state:
-    st.session_state.auth = {
-        "is_authenticated": False,
-        "user_name": None,
-        "role": None,
-    }
-
-if not st.session_state.auth["is_authenticated"]:
-    # Show login screen only
-    login_mock()
-    st.stop()
-
-# If we get here, user is logged in
-role = st.session_state.auth["role"]
-user_name = st.session_state.auth["user_name"]
-
-
-# ==============================
-# SIDEBAR: USER + LEGAL INFO
-# ==============================
-
-with st.sidebar:
-    st.title("ATS Prototype")
-    st.markdown(f"**Logged in as:** {user_name}")
-    st.markdown(f"**Role:** {role}")
-
-    if st.button("Log out"):
-        st.session_state.clear()
-        st.rerun()
-
-    with st.expander("Legal Compliance Info"):
-        st.markdown(
-            """
-            - This tool generates **draft** feedback only.  
-            - All emails must be **reviewed and approved by HR** before sending.  
-            - Feedback is restricted to **job-related, hard-skill-based** criteria.  
-            - The system is designed to avoid references to personality, age, gender,
-              culture fit, or any protected characteristic.
-            """
-        )
-
-
-# ==============================
-# APP HEADER
-# ==============================
-
-st.title("⚖️ Compliant ATS Prototype")
-
-if role == "Recruiter":
-    st.subheader("Recruiter Dashboard – Rank Candidates & Generate Compliant Feedback")
-    st.warning(
-        "Legal Notice: All generated feedback must be reviewed by HR before sending to candidates. "
-        "This system provides drafts only."
-    )
-elif role == "Applicant":
-    st.subheader("Applicant Dashboard – Check Fit, Get Feedback & Optimise Your Resume")
-
-
-# ====================================================
-# RECRUITER MODE
-# ====================================================
-
-if role == "Recruiter":
-    tab1, tab2, tab3 = st.tabs(["⚙️ Setup & Upload", "📊 Ranking & Scores", "📧 Feedback Generator"])
-
-    if "ranked_data" not in st.session_state:
-        st.session_state["ranked_data"] = None
-        st.session_state["job_description"] = ""
-
-    # ---------- TAB 1: Setup & Upload ----------
-    with tab1:
-        st.header("1. Define Job & Gather Resumes")
-
-        col1, col2 = st.columns(2)
-
-        with col1:
-            st.subheader("Job Description")
-            job_description = st.text_area(
-                "Paste the Full Job Description Here:",
-                height=300,
-                key="job_desc_input_recruiter",
-                value=st.session_state.get(
-                    "job_description",
-                    (
-                        "We need a Chief Financial Officer (CFO). Must have CPA certification. "
-                        "Experience managing large corporate budgets. Strategic financial planning."
-                    ),
-                ),
-            )
-            st.session_state["job_description"] = job_description
-
-        with col2:
-            st.subheader("Candidate Resumes")
-            uploaded_files = st.file_uploader(
-                "Upload Resumes (PDF, DOCX, and DOC supported):",
-                type=["pdf", "docx", "doc"],
-                accept_multiple_files=True,
-            )
-
-        st.markdown("---")
-
-        if uploaded_files and st.button("🚀 Run Ranking Engine", type="primary"):
-            if not job_description:
-                st.error("Please paste the Job Description before running the engine.")
-                st.stop()
-
-            with st.spinner("Processing files, cleaning with AI, and running vector embedding analysis..."):
-                candidate_list_for_ranking = []
-
-                for file in uploaded_files:
-                    filename = file.name.lower()
-                    raw_resume_text = ""
-
-                    if filename.endswith(".pdf"):
-                        raw_resume_text = extract_text_from_pdf(file)
-                    elif filename.endswith(".docx") or filename.endswith(".doc"):
-                        raw_resume_text = extract_text_from_docx(file)
-                    else:
-                        st.warning(f"Unsupported file type for {file.name}. Skipping.")
-                        continue
-
-                    if raw_resume_text:
-                        clean_resume_text = clean_and_structure_resume(raw_resume_text)
-                        candidate_list_for_ranking.append(
-                            {
-                                "name": file.name,
-                                "resume": clean_resume_text,
-                            }
-                        )
-
-                if candidate_list_for_ranking:
-                    st.info(f"Successfully processed and cleaned {len(candidate_list_for_ranking)} resumes.")
-
-                    ranking_results = rank_candidates(job_description, candidate_list_for_ranking)
-                    st.session_state["ranked_data"] = ranking_results
-                    st.success("Ranking Complete! See the **Ranking & Scores** tab.")
-                else:
-                    st.warning("No valid files were processed.")
-
-    # ---------- TAB 2: Ranking & Scores ----------
-    with tab2:
-        st.header("2. Candidate Ranking Results")
-
-        if st.session_state.get("ranked_data") is not None:
-            ranking_results = st.session_state["ranked_data"]
-
-            df = pd.DataFrame(ranking_results)
-            df["Score"] = (df["score"] * 100).round(1).astype(str) + "%"
-            df_display = df[["name", "Score"]].rename(columns={"name": "Candidate"})
-
-            st.subheader("Semantic Match Scoreboard")
-            st.dataframe(df_display, use_container_width=True)
-
-            st.info("The table is sorted by score (highest match first).")
-
-            st.subheader("Review Cleaned Resume Text")
-            candidate_names = [r["name"] for r in ranking_results]
-            selected_name = st.selectbox("Select Candidate to Review:", candidate_names)
-
-            selected_candidate = next((r for r in ranking_results if r["name"] == selected_name), None)
-
-            if selected_candidate:
-                with st.expander(f"Cleaned Resume Text for {selected_name}"):
-                    st.code(selected_candidate["resume"], language="markdown")
-        else:
-            st.warning("Please run the ranking engine in the 'Setup & Upload' tab first.")
-
-    # ---------- TAB 3: Feedback Generator ----------
-    with tab3:
-        st.header("3. Generate Compliant Rejection Feedback")
-
-        if st.session_state.get("ranked_data") is not None:
-            ranking_results = st.session_state["ranked_data"]
-            job_description = st.session_state["job_description"]
-
-            # Lowest ranking candidate
-            candidate_to_reject = ranking_results[-1]
-
-            # Extract name without file extension
-            candidate_name = (
-                candidate_to_reject["name"]
-                .replace(".pdf", "")
-                .replace(".docx", "")
-                .replace(".doc", "")
-            )
-
-            st.info(
-                f"Targeting **{candidate_name}** "
-                f"(Lowest Score: {(candidate_to_reject['score'] * 100):.1f}%) for compliant feedback."
-            )
-
-            if st.button(f"✍️ Generate Rejection Email for {candidate_name}"):
-                with st.spinner("Generating compliant, hard-skill-based email..."):
-                    feedback_draft = generate_rejection_email(
-                        job_description=job_description,
-                        cleaned_resume=candidate_to_reject["resume"],
-                        candidate_name=candidate_name,
-                    )
-
-                st.subheader("📧 Draft Email (Review Required)")
-                st.code(feedback_draft, language="text")
-
-                if st.checkbox("I confirm this feedback is legally safe and accurate."):
-                    st.success("✅ Email approved and ready to send.")
-
-                    st.download_button(
-                        label="📩 Download Email Draft",
-                        data=feedback_draft,
-                        file_name=f"Rejection_Email_{candidate_name}.txt",
-                        mime="text/plain",
-                    )
-        else:
-            st.warning("Please run the ranking engine in the 'Setup & Upload' tab first.")
-
-
-# ====================================================
-# APPLICANT MODE
-# ====================================================
-elif role == "Applicant":
-    st.subheader("Applicant Dashboard – Check Fit, Get Feedback & Improve Resume")
-
-    st.markdown(
-        "Upload your resume and paste the job description to get your ATS fit score, "
-        "a list of actionable improvements, and an AI-optimised resume."
-    )
-
-    col1, col2 = st.columns(2)
-
-    with col1:
-        jd_applicant = st.text_area(
-            "Paste the Job Description:",
-            height=260,
-            key="jd_applicant_input",
-            placeholder="Paste the job description you are applying for...",
-        )
-
-    with col2:
-        resume_file = st.file_uploader(
-            "Upload Your Resume (PDF, DOCX, or DOC):",
-            type=["pdf", "docx", "doc"],
-            key="applicant_uploader",
-        )
-        manual_resume_text = st.text_area(
-            "Or paste your resume text here:",
-            height=260,
-            key="manual_applicant_text",
-            placeholder="If you don't have a file, paste your resume content here...",
-        )
-
-    analyze_button = st.button("🔍 Analyse & Improve My Resume", type="primary")
-
-    if analyze_button:
-
-        if not jd_applicant:
-            st.error("Please paste the Job Description first.")
-            st.stop()
-
-        # --- Extract resume ---
-        if resume_file is not None:
-            name = resume_file.name.lower()
-            if name.endswith(".pdf"):
-                raw_resume = extract_text_from_pdf(resume_file)
-            elif name.endswith(".docx"):
-                raw_resume = extract_text_from_docx(resume_file)
-            else:
-                st.error("Unsupported file type. Upload PDF or DOCX.")
-                st.stop()
-        elif manual_resume_text.strip():
-            raw_resume = manual_resume_text.strip()
-        else:
-            st.error("Please upload a resume file or paste text.")
-            st.stop()
-
-        # --- Processing ---
-        with st.spinner("Analysing your resume and generating feedback..."):
-
-            cleaned_resume = clean_and_structure_resume(raw_resume)
-            score = compute_fit_score(jd_applicant, cleaned_resume)
-            applicant_feedback_list = generate_applicant_list_feedback(jd_applicant, cleaned_resume)
-            optimised_resume_md = rewrite_resume(jd_applicant, cleaned_resume)
-
-        # --- OUTPUT (NOW SAFE — inside analyze_button block) ---
-        st.success("Analysis complete! Scroll down to view results.")
-
-        # Fit score
-        st.header("1. ATS Fit Score")
-        score_percent = max(0.0, min(1.0, score)) * 100
-
-        col_a, col_b = st.columns([1, 3])
-        with col_a:
-            st.metric("Match Score", f"{score_percent:.1f}%")
-        with col_b:
-            st.progress(score_percent / 100)
-
-        st.caption("This score reflects the similarity between your resume and the job description.")
-
-        # Feedback
-        st.header("2. Actionable Feedback")
-        st.markdown("Use the points below to improve your resume alignment:")
-        st.markdown(applicant_feedback_list)
-
-        # Optimised resume
-        st.header("3. AI-Optimised Resume")
-        st.markdown("Below is an improved version of your resume:")
-        st.code(optimised_resume_md, language="markdown")
-
-        st.download_button(
-            label="📩 Download Optimised Resume (Markdown)",
-            data=optimised_resume_md,
-            file_name="optimised_resume.md",
-            mime="text/markdown",
-        )
-
+import hashlib
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import streamlit as st
+
+# newats_engine (and through it openai, numpy, pypdf/fitz) is
+# imported lazily inside the branches that need it, so the login screen
+# paints without paying for the whole engine stack. Python caches the
+# module after the first import, so reruns only pay a dict lookup.
+#
+# The engine's heavy singletons — the OpenAI client, the semantic LLM
+# cache and the compiled compliance checker — are module globals built on
+# that first import and kept alive by sys.modules, which gives them the
+# same once-per-process lifetime @st.cache_resource would. Wrapping them
+# again here would only add a cache lookup in front of a dict lookup.
+
+# ==============================
+# CACHED FILE PARSING
+# ==============================
+# Streamlit reruns the whole script on every widget interaction, so
+# resume parsing is memoized on the raw file bytes. Re-selecting a tab
+# or toggling a checkbox no longer re-parses the uploads.
+
+@st.cache_data(show_spinner=False)
+def cached_extract_pdf(file_bytes: bytes) -> str:
+    from newats_engine import extract_text_from_pdf
+
+    return extract_text_from_pdf(io.BytesIO(file_bytes))
+
+
+@st.cache_data(show_spinner=False)
+def cached_extract_docx(file_bytes: bytes) -> str:
+    from newats_engine import extract_text_from_docx
+
+    return extract_text_from_docx(io.BytesIO(file_bytes))
+
+
+# Single place that knows which suffixes we can parse; every upload
+# site dispatches through this instead of its own endswith ladder.
+EXTRACTORS = {
+    ".pdf": cached_extract_pdf,
+    ".docx": cached_extract_docx,
+    ".doc": cached_extract_docx,
+}
+
+# Strips a trailing resume-file extension from a display name in one
+# pass, case variants included.
+_EXT_RE = re.compile(r"\.(pdf|docx|doc)$", re.IGNORECASE)
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_clean_resume(raw_text: str) -> str:
+    """LLM cleaning is deterministic (temperature 0), so memoize on the
+    raw text and stop re-cleaning identical resumes across reruns."""
+    from newats_engine import CLEAN_ERROR_PREFIX, clean_and_structure_resume
+
+    cleaned = clean_and_structure_resume(raw_text)
+    if cleaned.startswith(CLEAN_ERROR_PREFIX):
+        # Raising keeps st.cache_data from memoizing a transient API
+        # failure; the next run retries instead of replaying the error.
+        raise RuntimeError(cleaned)
+    return cleaned
+
+
+def cached_clean_batch(raw_texts: tuple) -> list:
+    """Batch variant for the recruiter loop: overlaps the per-resume
+    cleaning round trips instead of paying them one after another.
+    Deliberately not behind st.cache_data — results may contain
+    per-resume error sentinels, and the session-state hash cache already
+    memoizes the successful ones per file."""
+    from newats_engine import clean_resumes_batch
+
+    return clean_resumes_batch(list(raw_texts))
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_fit_score(jd_text: str, resume_text: str) -> float:
+    """Fit scoring is deterministic given its inputs, so re-analysing the
+    same JD/resume pair costs a cache lookup instead of two embeds."""
+    from newats_engine import compute_fit_score
+
+    return compute_fit_score(jd_text, resume_text, jd_vec=embed_jd(jd_text))
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def embed_jd(jd_text: str):
+    """One JD embedding per session; reused by ranking and fit scoring."""
+    from newats_engine import get_embedding
+
+    return get_embedding(jd_text)
+
+
+# ==============================
+# LOGIN MOCK FOR PROTOTYPE
+# ==============================
+
+def login_mock():
+    """
+    Temporary login for prototype.
+    Replace later with real auth (e.g. SSO).
+    """
+    st.title("Login to Compliant ATS")
+    st.write("Use this simple login while prototyping.")
+
+    role = st.radio("I am logging in as:", ["Recruiter", "Applicant"])
+    user_name = st.text_input("Your name")
+
+    if st.button("Continue"):
+        if not user_name.strip():
+            st.error("Please enter a name.")
+        else:
+            st.session_state.auth = {
+                "is_authenticated": True,
+                "user_name": user_name.strip(),
+                "role": role,
+            }
+            st.success(f"Welcome, {user_name.strip()}! Logged in as {role}.")
+            st.rerun()
+
+
+# ==============================
+# APPLICANT LIST FEEDBACK HELPER
+# ==============================
+
+_REJECTION_EMAIL_SYSTEM_PROMPT = """
+    You are an Expert Resume Consultant and Compliance Officer. 
+    Your job is to generate a *polite, professional rejection email* that is fully legally compliant.
+
+    ⚠️ Your output MUST ALWAYS be a COMPLETE EMAIL.  
+    ⚠️ NOT a list.  
+    ⚠️ NOT bullet points alone.  
+    ⚠️ NOT freeform commentary.  
+    Only a polished email with the structure below.
+
+    ------------------------------------------
+    EMAIL FORMAT (YOU MUST FOLLOW THIS EXACTLY)
+    ------------------------------------------
+
+    Subject: Feedback on Your Application
+
+    Hi [Candidate Name],
+
+    Thank the candidate sincerely for applying.  
+    Explain that after reviewing their application in relation to the job description, 
+    the company will not be moving forward.  
+    Keep the tone neutral, factual, and professional.
+
+    Then provide TWO SECTIONS:
+
+    ### 🔎 Key Areas of Alignment
+    • 2–3 bullet points listing the candidate’s strengths that *directly match the job description*.
+
+    ### 🎯 Key Areas to Strengthen
+    • 5–7 bullet points describing hard-skill or experience gaps that prevented progression.
+    • Reference only skills, tools, systems, technical depth, demonstrated experience, 
+      or missing measurable outcomes.
+    • Be specific, factual, and based ONLY on the resume + job description.
+
+    Closing paragraph:
+    Thank them again for their interest.  
+    Wish them success in their job search.  
+    Sign off as “HR Team”.
+
+    ------------------------------------------
+    LEGAL COMPLIANCE RULES (MANDATORY)
+    ------------------------------------------
+    - DO NOT mention personality, attitude, soft skills, or cultural fit.
+    - DO NOT reference protected traits (gender, age, race, health, etc).
+    - DO NOT speculate about ability or experience.
+    - ONLY refer to job-related, demonstrable hard skills or experience.
+    """
+
+
+# Resumes beyond roughly this many characters (~2000 gpt-4o tokens at
+# ~4 chars/token) get trimmed to their most JD-relevant paragraphs
+# before the rejection-email call; shorter ones go through unchanged.
+_EXCERPT_CHAR_BUDGET = 8000
+_EXCERPT_TOP_K = 12
+
+
+def _relevant_resume_excerpt(job_description: str, cleaned_resume: str) -> str:
+    """Trim a long resume to its top JD-relevant paragraphs.
+
+    The email only draws on the structured bullets that relate to the
+    role, so sending all 3-6k tokens wastes input cost and time to first
+    token. Paragraphs are scored by embedding similarity to the JD (both
+    sides served from the disk-backed embedding cache) and the best
+    `_EXCERPT_TOP_K` are kept in their original order.
+    """
+    if len(cleaned_resume) <= _EXCERPT_CHAR_BUDGET:
+        return cleaned_resume
+
+    paragraphs = [p.strip() for p in cleaned_resume.split("\n\n") if p.strip()]
+    if len(paragraphs) <= _EXCERPT_TOP_K:
+        return cleaned_resume
+
+    import numpy as np
+
+    from newats_engine import get_embeddings
+
+    vecs = np.asarray(
+        get_embeddings([job_description] + paragraphs), dtype=np.float32
+    )
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vecs /= norms
+    scores = vecs[1:] @ vecs[0]
+
+    keep = sorted(np.argsort(-scores)[:_EXCERPT_TOP_K])
+    return "\n\n".join(paragraphs[i] for i in keep)
+
+
+def generate_rejection_email(
+    job_description: str,
+    cleaned_resume: str,
+    candidate_name: str = "the candidate",
+    on_delta=None,
+) -> str:
+    """
+    Generates a fully formatted, legally compliant rejection email
+    based on JD + cleaned resume content. When `on_delta` is given it is
+    called with the accumulated draft as tokens stream in, so the UI can
+    render progressively instead of blocking on the full completion.
+    """
+
+    resume_excerpt = _relevant_resume_excerpt(job_description, cleaned_resume)
+
+    user_prompt = f"""
+    Candidate Name: {candidate_name}
+
+    Job Description:
+    {job_description}
+
+    Cleaned Resume:
+    {resume_excerpt}
+
+    Write the rejection email following the exact required format.
+    """
+
+    from newats_engine import client, semantic_cache
+
+    # Near-identical (JD, resume) pairs reuse the previous draft instead
+    # of repeating the gpt-4o call.
+    semantic_key = f"rejection-email|{candidate_name}|{job_description}\n\n{cleaned_resume}"
+    cached = semantic_cache.get(semantic_key)
+    if cached is not None:
+        return cached
+
+    stream = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": _REJECTION_EMAIL_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.0,  # deterministic, consistent output
+        stream=True,
+    )
+
+    email = ""
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if delta:
+            email += delta
+            if on_delta is not None:
+                on_delta(email)
+
+    semantic_cache.put(semantic_key, email)
+    return email
+
+
+
+# ==============================
+# PAGE CONFIG
+# ==============================
+
+st.set_page_config(page_title="Compliant ATS Prototype", layout="wide")
+
+
+# ==============================
+# AUTH INITIALISATION
+# ==============================
+
+if "auth" not in st.session_state:
+    st.session_state.auth = {
+        "is_authenticated": False,
+        "user_name": None,
+        "role": None,
+    }
+
+if not st.session_state.auth["is_authenticated"]:
+    # Show login screen only
+    login_mock()
+    st.stop()
+
+# If we get here, user is logged in
+role = st.session_state.auth["role"]
+user_name = st.session_state.auth["user_name"]
+
+
+# ==============================
+# SIDEBAR: USER + LEGAL INFO
+# ==============================
+
+with st.sidebar:
+    st.title("ATS Prototype")
+    st.markdown(f"**Logged in as:** {user_name}")
+    st.markdown(f"**Role:** {role}")
+
+    if st.button("Log out"):
+        st.session_state.clear()
+        st.rerun()
+
+    with st.expander("Legal Compliance Info"):
+        st.markdown(
+            """
+            - This tool generates **draft** feedback only.  
+            - All emails must be **reviewed and approved by HR** before sending.  
+            - Feedback is restricted to **job-related, hard-skill-based** criteria.  
+            - The system is designed to avoid references to personality, age, gender,
+              culture fit, or any protected characteristic.
+            """
+        )
+
+
+# ==============================
+# APP HEADER
+# ==============================
+
+st.title("⚖️ Compliant ATS Prototype")
+
+if role == "Recruiter":
+    st.subheader("Recruiter Dashboard – Rank Candidates & Generate Compliant Feedback")
+    st.warning(
+        "Legal Notice: All generated feedback must be reviewed by HR before sending to candidates. "
+        "This system provides drafts only."
+    )
+elif role == "Applicant":
+    st.subheader("Applicant Dashboard – Check Fit, Get Feedback & Optimise Your Resume")
+
+
+# ====================================================
+# RECRUITER MODE
+# ====================================================
+
+if role == "Recruiter":
+    from newats_engine import rank_candidates
+
+    tab1, tab2, tab3 = st.tabs(["⚙️ Setup & Upload", "📊 Ranking & Scores", "📧 Feedback Generator"])
+
+    if "ranked_data" not in st.session_state:
+        st.session_state["ranked_data"] = None
+        st.session_state["ranked_rows"] = None
+        st.session_state["ranked_by_name"] = None
+        st.session_state["job_description"] = ""
+
+    # ---------- TAB 1: Setup & Upload ----------
+    with tab1:
+        st.header("1. Define Job & Gather Resumes")
+
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.subheader("Job Description")
+            job_description = st.text_area(
+                "Paste the Full Job Description Here:",
+                height=300,
+                key="job_desc_input_recruiter",
+                value=st.session_state.get(
+                    "job_description",
+                    (
+                        "We need a Chief Financial Officer (CFO). Must have CPA certification. "
+                        "Experience managing large corporate budgets. Strategic financial planning."
+                    ),
+                ),
+            )
+            st.session_state["job_description"] = job_description
+
+        with col2:
+            st.subheader("Candidate Resumes")
+            uploaded_files = st.file_uploader(
+                "Upload Resumes (PDF, DOCX, and DOC supported):",
+                type=["pdf", "docx", "doc"],
+                accept_multiple_files=True,
+            )
+
+        st.markdown("---")
+
+        if uploaded_files and st.button("🚀 Run Ranking Engine", type="primary"):
+            if not job_description:
+                st.error("Please paste the Job Description before running the engine.")
+                st.stop()
+
+            with st.spinner("Processing files, cleaning with AI, and running vector embedding analysis..."):
+                def _extract_one(payload):
+                    """Parse one upload's bytes to raw text (runs in a worker thread)."""
+                    suffix, data = payload
+                    extractor = EXTRACTORS.get(suffix)
+                    return extractor(data) if extractor else None
+
+                # Read each upload exactly once, up front; workers only see
+                # immutable (name, bytes) pairs, so reruns and tab switches
+                # can never re-trigger I/O on the UploadedFile. st.cache_data
+                # hashes the bytes itself, so that read doubles as the cache
+                # key derivation.
+                payloads = [
+                    (Path(file.name).suffix.lower(), file.getvalue())
+                    for file in uploaded_files
+                ]
+
+                # Parsing each file is independent, so fan it out instead of
+                # going resume-by-resume. Batches under 3 files skip the
+                # pool entirely — startup overhead would eat the win.
+                if len(payloads) < 3:
+                    extracted = [_extract_one(payload) for payload in payloads]
+                else:
+                    # PyMuPDF and the zip/XML docx path do their heavy
+                    # lifting in C with the GIL released, so extraction
+                    # scales past the core count on decompression stalls.
+                    with ThreadPoolExecutor(
+                        max_workers=min(8, len(payloads))
+                    ) as executor:
+                        extracted = list(executor.map(_extract_one, payloads))
+
+                # Cleaned text is memoized per file-content hash in session
+                # state, so re-clicking Run with an unchanged pool (or an
+                # overlapping one — one new file only cleans that file)
+                # skips the LLM entirely for known resumes.
+                clean_cache = st.session_state.setdefault("clean_cache", {})
+
+                entries = []  # (display name, content hash, raw text)
+                for file, (_, data), raw_resume_text in zip(
+                    uploaded_files, payloads, extracted
+                ):
+                    if raw_resume_text is None:
+                        st.warning(f"Unsupported file type for {file.name}. Skipping.")
+                    elif raw_resume_text:
+                        digest = hashlib.sha256(data).hexdigest()
+                        entries.append((file.name, digest, raw_resume_text))
+
+                # Cleaning is one LLM round trip per resume; the batch
+                # helper overlaps the cache misses so twenty new resumes
+                # cost roughly one call's latency instead of twenty.
+                pending = {
+                    digest: raw
+                    for _, digest, raw in entries
+                    if digest not in clean_cache
+                }
+                if pending:
+                    from newats_engine import CLEAN_ERROR_PREFIX
+
+                    cleaned_texts = cached_clean_batch(tuple(pending.values()))
+                    # Only successful cleans go into the cache; a failed
+                    # resume stays pending so the next click retries it
+                    # instead of ranking (or emailing) the error text.
+                    clean_cache.update(
+                        (digest, cleaned)
+                        for digest, cleaned in zip(pending, cleaned_texts)
+                        if not cleaned.startswith(CLEAN_ERROR_PREFIX)
+                    )
+
+                candidate_list_for_ranking = []
+                for name, digest, _ in entries:
+                    cleaned = clean_cache.get(digest)
+                    if cleaned is None:
+                        st.warning(
+                            f"Cleaning failed for {name}; it was left out of "
+                            "this run. Re-click to retry."
+                        )
+                    else:
+                        candidate_list_for_ranking.append(
+                            {"name": name, "resume": cleaned}
+                        )
+
+                if candidate_list_for_ranking:
+                    st.info(f"Successfully processed and cleaned {len(candidate_list_for_ranking)} resumes.")
+
+                    ranking_results = rank_candidates(
+                        job_description,
+                        candidate_list_for_ranking,
+                        jd_vec=embed_jd(job_description),
+                    )
+                    st.session_state["ranked_data"] = ranking_results
+
+                    # Build the display table once here; the Ranking tab
+                    # otherwise reconstructs it on every widget interaction
+                    # even though nothing changed. st.dataframe renders a
+                    # list of dicts directly — no need to drag pandas in
+                    # just to rename and format two columns.
+                    st.session_state["ranked_rows"] = [
+                        {
+                            "Candidate": r["name"],
+                            "Score": f"{r['score'] * 100:.1f}%",
+                        }
+                        for r in ranking_results
+                    ]
+                    st.session_state["ranked_by_name"] = {
+                        r["name"]: r for r in ranking_results
+                    }
+
+                    st.success("Ranking Complete! See the **Ranking & Scores** tab.")
+                else:
+                    st.warning("No valid files were processed.")
+
+    # ---------- TAB 2: Ranking & Scores ----------
+    with tab2:
+        st.header("2. Candidate Ranking Results")
+
+        if st.session_state.get("ranked_data") is not None:
+            ranking_results = st.session_state["ranked_data"]
+
+            st.subheader("Semantic Match Scoreboard")
+            st.dataframe(st.session_state["ranked_rows"], use_container_width=True)
+
+            st.info("The table is sorted by score (highest match first).")
+
+            st.subheader("Review Cleaned Resume Text")
+            # Built once at ranking time; the selectbox reruns the script
+            # on every change and a dict lookup beats rescanning (or
+            # re-indexing) the results list.
+            by_name = st.session_state["ranked_by_name"]
+            selected_name = st.selectbox("Select Candidate to Review:", list(by_name))
+
+            selected_candidate = by_name.get(selected_name)
+
+            if selected_candidate:
+                with st.expander(f"Cleaned Resume Text for {selected_name}"):
+                    # Syntax-highlighting a large resume via st.code made
+                    # every selectbox change visibly laggy, so the text is
+                    # opt-in, rendered plain, and capped at 8 KB with the
+                    # full content behind a download instead.
+                    if st.checkbox("Show cleaned text", key=f"show_{selected_name}"):
+                        st.text(selected_candidate["resume"][:8192])
+                        if len(selected_candidate["resume"]) > 8192:
+                            st.caption("Preview truncated to 8 KB.")
+                    st.download_button(
+                        label="⬇️ Download full cleaned text",
+                        data=selected_candidate["resume"],
+                        file_name=f"{selected_name}_cleaned.txt",
+                        mime="text/plain",
+                        key=f"dl_{selected_name}",
+                    )
+        else:
+            st.warning("Please run the ranking engine in the 'Setup & Upload' tab first.")
+
+    # ---------- TAB 3: Feedback Generator ----------
+    with tab3:
+        st.header("3. Generate Compliant Rejection Feedback")
+
+        if st.session_state.get("ranked_data") is not None:
+            ranking_results = st.session_state["ranked_data"]
+            job_description = st.session_state["job_description"]
+
+            # Lowest ranking candidate
+            candidate_to_reject = ranking_results[-1]
+
+            # Extract name without file extension
+            candidate_name = _EXT_RE.sub("", candidate_to_reject["name"])
+
+            st.info(
+                f"Targeting **{candidate_name}** "
+                f"(Lowest Score: {(candidate_to_reject['score'] * 100):.1f}%) for compliant feedback."
+            )
+
+            if st.button(f"✍️ Generate Rejection Email for {candidate_name}"):
+                with st.spinner("Generating compliant, hard-skill-based email..."):
+                    # Render the draft as it streams in; the first tokens
+                    # appear in well under a second instead of after the
+                    # whole completion.
+                    draft_placeholder = st.empty()
+                    feedback_draft = generate_rejection_email(
+                        job_description=job_description,
+                        cleaned_resume=candidate_to_reject["resume"],
+                        candidate_name=candidate_name,
+                        on_delta=lambda buf: draft_placeholder.code(buf, language="text"),
+                    )
+                    draft_placeholder.empty()
+
+                # Keep the draft in session state: the review widgets below
+                # rerun the script, and without this the draft vanished (and
+                # the generation re-triggered) on every interaction.
+                st.session_state["feedback_draft"] = feedback_draft
+                st.session_state["feedback_draft_for"] = candidate_name
+
+            if (
+                st.session_state.get("feedback_draft")
+                and st.session_state.get("feedback_draft_for") == candidate_name
+            ):
+                feedback_draft = st.session_state["feedback_draft"]
+
+                st.subheader("📧 Draft Email (Review Required)")
+                st.code(feedback_draft, language="text")
+
+                # The form batches the review interaction: only the submit
+                # click reruns the script, not every checkbox toggle.
+                with st.form("hr_review"):
+                    confirmed = st.checkbox(
+                        "I confirm this feedback is legally safe and accurate."
+                    )
+                    submitted = st.form_submit_button("Confirm review")
+
+                if submitted and confirmed:
+                    st.success("✅ Email approved and ready to send.")
+
+                    st.download_button(
+                        label="📩 Download Email Draft",
+                        data=feedback_draft,
+                        file_name=f"Rejection_Email_{candidate_name}.txt",
+                        mime="text/plain",
+                    )
+        else:
+            st.warning("Please run the ranking engine in the 'Setup & Upload' tab first.")
+
+
+# ====================================================
+# APPLICANT MODE
+# ====================================================
+elif role == "Applicant":
+    from newats_engine import (
+        generate_applicant_list_feedback,
+        rewrite_resume,
+    )
+
+    st.subheader("Applicant Dashboard – Check Fit, Get Feedback & Improve Resume")
+
+    st.markdown(
+        "Upload your resume and paste the job description to get your ATS fit score, "
+        "a list of actionable improvements, and an AI-optimised resume."
+    )
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        jd_applicant = st.text_area(
+            "Paste the Job Description:",
+            height=260,
+            key="jd_applicant_input",
+            placeholder="Paste the job description you are applying for...",
+        )
+
+    with col2:
+        resume_file = st.file_uploader(
+            "Upload Your Resume (PDF, DOCX, or DOC):",
+            type=["pdf", "docx", "doc"],
+            key="applicant_uploader",
+        )
+        manual_resume_text = st.text_area(
+            "Or paste your resume text here:",
+            height=260,
+            key="manual_applicant_text",
+            placeholder="If you don't have a file, paste your resume content here...",
+        )
+
+    analyze_button = st.button("🔍 Analyse & Improve My Resume", type="primary")
+
+    if analyze_button:
+
+        if not jd_applicant:
+            st.error("Please paste the Job Description first.")
+            st.stop()
+
+        # --- Extract resume ---
+        if resume_file is not None:
+            extractor = EXTRACTORS.get(Path(resume_file.name).suffix.lower())
+            if extractor is None:
+                st.error("Unsupported file type. Upload PDF or DOCX.")
+                st.stop()
+            raw_resume = extractor(resume_file.getvalue())
+        elif manual_resume_text.strip():
+            raw_resume = manual_resume_text.strip()
+        else:
+            st.error("Please upload a resume file or paste text.")
+            st.stop()
+
+        # --- Processing ---
+        with st.spinner("Analysing your resume and generating feedback..."):
+
+            try:
+                cleaned_resume = cached_clean_resume(raw_resume)
+            except RuntimeError as e:
+                st.error(f"Resume cleaning failed: {e}. Please try again.")
+                st.stop()
+            score = cached_fit_score(jd_applicant, cleaned_resume)
+            applicant_feedback_list = generate_applicant_list_feedback(jd_applicant, cleaned_resume)
+            optimised_resume_md = rewrite_resume(jd_applicant, cleaned_resume)
+
+        # --- OUTPUT (NOW SAFE — inside analyze_button block) ---
+        st.success("Analysis complete! Scroll down to view results.")
+
+        # Fit score
+        st.header("1. ATS Fit Score")
+        score_percent = max(0.0, min(1.0, score)) * 100
+
+        col_a, col_b = st.columns([1, 3])
+        with col_a:
+            st.metric("Match Score", f"{score_percent:.1f}%")
+        with col_b:
+            st.progress(score_percent / 100)
+
+        st.caption("This score reflects the similarity between your resume and the job description.")
+
+        # Feedback
+        st.header("2. Actionable Feedback")
+        st.markdown("Use the points below to improve your resume alignment:")
+        st.markdown(applicant_feedback_list)
+
+        # Optimised resume
+        st.header("3. AI-Optimised Resume")
+        st.markdown("Below is an improved version of your resume:")
+        # Plain text keeps the rerun cheap on long resumes; the download
+        # below always carries the full markdown.
+        st.text(optimised_resume_md[:8192])
+        if len(optimised_resume_md) > 8192:
+            st.caption("Preview truncated to 8 KB — download for the full version.")
+
+        st.download_button(
+            label="📩 Download Optimised Resume (Markdown)",
+            data=optimised_resume_md,
+            file_name="optimised_resume.md",
+            mime="text/markdown",
+        )
+
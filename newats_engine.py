@@ -1,204 +1,1062 @@
-import os
-import io
-try:
-    from docx import Document
-except Exception:
-    Document = None
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from pypdf import PdfReader
-
-# Optional dotenv import
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
-
-# Try to import Streamlit if available
-try:
-    import streamlit as st
-except ImportError:
-    st = None
-
-
-# -------------------------
-# OPENAI CLIENT SETUP
-# -------------------------
-def get_openai_api_key() -> str:
-    """Load API key from Streamlit secrets or environment variables."""
-    if st is not None:
-        try:
-            return st.secrets["OPENAI_API_KEY"]
-        except Exception:
-            pass
-
-    key = os.getenv("OPENAI_API_KEY")
-    if key:
-        return key
-
-    msg = "OPENAI_API_KEY missing. Set it in Streamlit secrets or .env."
-    if st is not None:
-        st.error(msg)
-        st.stop()
-    raise RuntimeError(msg)
-
-
-OPENAI_API_KEY = get_openai_api_key()
-
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-
-# ======================================================
-# 1. PDF TEXT EXTRACTION
-# ======================================================
-def extract_text_from_pdf(uploaded_file):
-    """Reads a Streamlit UploadedFile object and extracts raw text."""
-    uploaded_file.seek(0)
-    reader = PdfReader(io.BytesIO(uploaded_file.read()))
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() or ""
-    return text.strip()
-
-# ======================================================
-# 2. DOCX TEXT EXTRACTION
-# ======================================================
-def extract_text_from_docx(uploaded_file):
-    """Reads a Streamlit UploadedFile object and extracts text from DOCX."""
-    # Ensure we read from the beginning
-    uploaded_file.seek(0)
-    if Document is None:
-        raise RuntimeError(
-            "Missing dependency: python-docx. Install with 'pip install python-docx' "
-            "or add it to requirements.txt."
-        )
-    doc = Document(uploaded_file)
-    text = []
-    for para in doc.paragraphs:
-        if para.text:
-            text.append(para.text)
-    return "\n".join(text).strip()
-
-
-
-# ======================================================
-# 2. CLEANING & STRUCTURING
-# ======================================================
-def clean_and_structure_resume(raw_resume_text):
-    """Uses LLM to clean noise and apply section tags."""
-    
-    system_prompt = """
-    You are an expert Document Processor. Clean noisy resume text and return structured sections:
-    [SUMMARY], [SKILLS], [EXPERIENCE], [EDUCATION]
-    """
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": raw_resume_text},
-            ],
-            temperature=0.0,
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error during cleaning: {e}"
-
-
-# ======================================================
-# 3. EMBEDDINGS + FIT SCORE + RANKING
-# ======================================================
-def get_embedding(text):
-    text = text.replace("\n", " ")
-    emb = client.embeddings.create(
-        input=[text], model="text-embedding-3-small"
-    ).data[0].embedding
-    return emb
-
-
-def compute_fit_score(job_description: str, resume_text: str) -> float:
-    jd_vec = get_embedding(job_description)
-    res_vec = get_embedding(resume_text)
-    score = cosine_similarity([jd_vec], [res_vec])[0][0]
-    return float(score)
-
-
-def rank_candidates(job_description, candidates_data):
-    jd_vec = get_embedding(job_description)
-    results = []
-
-    for c in candidates_data:
-        res_vec = get_embedding(c["resume"])
-        score = cosine_similarity([jd_vec], [res_vec])[0][0]
-        results.append({"name": c["name"], "score": score, "resume": c["resume"]})
-
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results
-
-
-# ======================================================
-# 4. FEEDBACK ENGINE
-# ======================================================
-def generate_compliant_feedback(job_description, candidate_resume):
-    """Generate legally compliant rejection feedback."""
-    system_prompt = """
-    You are a Compliance Resume Consultant. Provide lawful, hard-skill-focused feedback only.
-    """
-
-    user_prompt = f"""
-    JOB DESCRIPTION:
-    {job_description}
-
-    RESUME:
-    {candidate_resume}
-    """
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error: {e}"
-
-
-# ======================================================
-# 5. RESUME REWRITE ENGINE
-# ======================================================
-def rewrite_resume(job_description: str, resume_text: str) -> str:
-    """Rewrite resume for better alignment while staying truthful."""
-    system_prompt = """
-    You are an expert ATS Resume Writer. Maintain truth, improve clarity, 
-    rephrase bullets, strengthen relevance, but do not invent experience.
-    Output in Markdown.
-    """
-
-    prompt = f"""
-    JOB DESCRIPTION:
-    {job_description}
-
-    ORIGINAL RESUME:
-    {resume_text}
-
-    Rewrite the resume and then list what changed and why.
-    """
-
-    try:
-        res = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.4,
-        )
-        return res.choices[0].message.content
-    except Exception as e:
-        return f"Error during rewrite: {e}"
+import asyncio
+import hashlib
+import json
+import os
+import io
+import re
+import threading
+import zipfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.etree import ElementTree
+try:
+    from docx import Document
+except Exception:
+    Document = None
+import numpy as np
+from pypdf import PdfReader
+
+# PyMuPDF parses roughly an order of magnitude faster than pypdf; pypdf
+# stays as the fallback for installs without it (and its extractor also
+# covers files MuPDF declines to open).
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+# Optional FAISS backend for ranking very large candidate pools; the
+# BLAS GEMV path handles the usual tens-to-hundreds just fine.
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Optional dotenv import
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+# Try to import Streamlit if available
+try:
+    import streamlit as st
+except ImportError:
+    st = None
+
+
+# -------------------------
+# OPENAI CLIENT SETUP
+# -------------------------
+def get_openai_api_key() -> str:
+    """Load API key from Streamlit secrets or environment variables."""
+    if st is not None:
+        try:
+            return st.secrets["OPENAI_API_KEY"]
+        except Exception:
+            pass
+
+    key = os.getenv("OPENAI_API_KEY")
+    if key:
+        return key
+
+    msg = "OPENAI_API_KEY missing. Set it in Streamlit secrets or .env."
+    if st is not None:
+        st.error(msg)
+        st.stop()
+    raise RuntimeError(msg)
+
+
+OPENAI_API_KEY = get_openai_api_key()
+
+from openai import AsyncOpenAI, OpenAI
+client = OpenAI(api_key=OPENAI_API_KEY)
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+
+# ======================================================
+# 1. PDF TEXT EXTRACTION
+# ======================================================
+def _file_bytes(uploaded_file):
+    """Bytes-like view of an upload's contents. BytesIO-backed objects
+    (Streamlit uploads included) expose their buffer as a zero-copy
+    memoryview via getbuffer(); plain file objects fall back to read(),
+    which copies."""
+    uploaded_file.seek(0)
+    if hasattr(uploaded_file, "getbuffer"):
+        return uploaded_file.getbuffer()
+    return uploaded_file.read()
+
+
+def extract_text_from_pdf(uploaded_file):
+    """Reads a Streamlit UploadedFile object and extracts raw text."""
+    uploaded_file.seek(0)
+
+    if fitz is not None:
+        # fitz requires an actual bytes object for stream input, so the
+        # read() copy is unavoidable on this path.
+        try:
+            doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
+            try:
+                return "\n".join(page.get_text("text") for page in doc).strip()
+            finally:
+                doc.close()
+        except Exception:
+            # MuPDF declined the file (encrypted, corrupt, mislabelled);
+            # give pypdf a chance at it before reporting failure.
+            pass
+
+    reader = PdfReader(io.BytesIO(_file_bytes(uploaded_file)))
+    parts = []
+    for page in reader.pages:
+        # Image-only scan pages have no content stream worth decoding;
+        # skipping them avoids inflating their JPEG/JBIG2 streams.
+        if page.get("/Contents") is None:
+            continue
+        t = page.extract_text()
+        if t:
+            parts.append(t)
+    return "\n".join(parts).strip()
+
+# ======================================================
+# 2. DOCX TEXT EXTRACTION
+# ======================================================
+_DOCX_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def extract_text_from_docx(uploaded_file):
+    """Reads a Streamlit UploadedFile object and extracts text from DOCX."""
+    # Grab the buffer once; both the zip fast path and the python-docx
+    # fallback then parse the same in-memory data instead of re-reading
+    # through the upload wrapper, and getbuffer() skips the bytes copy
+    # read() would make on multi-MB files.
+    data = _file_bytes(uploaded_file)
+
+    # Fast path: a .docx is a zip; pull the w:t runs straight out of
+    # word/document.xml instead of building python-docx's full object
+    # model, which is several times slower for plain text extraction.
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            xml_bytes = archive.read("word/document.xml")
+        paragraphs = []
+        for para in ElementTree.fromstring(xml_bytes).iter(f"{_DOCX_W_NS}p"):
+            runs = [t.text for t in para.iter(f"{_DOCX_W_NS}t") if t.text]
+            if runs:
+                paragraphs.append("".join(runs))
+        return "\n".join(paragraphs).strip()
+    except Exception:
+        # Malformed archive or unexpected layout: fall back to python-docx.
+        pass
+
+    if Document is None:
+        raise RuntimeError(
+            "Missing dependency: python-docx. Install with 'pip install python-docx' "
+            "or add it to requirements.txt."
+        )
+    doc = Document(io.BytesIO(data))
+    text = []
+    for para in doc.paragraphs:
+        if para.text:
+            text.append(para.text)
+    return "\n".join(text).strip()
+
+
+
+# ======================================================
+# 2. CLEANING & STRUCTURING
+# ======================================================
+_CLEANING_SYSTEM_PROMPT = """
+You are an expert Document Processor. Clean noisy resume text and return structured sections:
+[SUMMARY], [SKILLS], [EXPERIENCE], [EDUCATION]
+"""
+
+# Cleaning is a mechanical reformat, so it runs on the mini model
+# (~10x cheaper, 2-3x lower latency, near-identical structuring);
+# the rewrite keeps full gpt-4o where output quality is the product.
+CLEAN_MODEL = "gpt-4o-mini"
+REWRITE_MODEL = "gpt-4o"
+
+# A cleaned resume should never outgrow its source by much; the cap
+# stops runaway generations from a pathological input.
+_CLEAN_MAX_TOKENS = 2000
+
+# Error returns from the cleaning paths start with this prefix so
+# callers (and their caches) can tell a transient failure from a
+# cleaned resume and avoid persisting it.
+CLEAN_ERROR_PREFIX = "Error during cleaning:"
+
+
+def _skip_cleaning(raw_resume_text):
+    """True when the LLM pass would add nothing: the text is too short to
+    have noise worth removing, or it already carries the section tags the
+    cleaner exists to produce (e.g. a re-submitted cleaned resume)."""
+    if len(raw_resume_text) < 200:
+        return True
+    return all(
+        tag in raw_resume_text for tag in ("[SKILLS]", "[EXPERIENCE]")
+    )
+
+
+def clean_and_structure_resume(raw_resume_text):
+    """Uses LLM to clean noise and apply section tags."""
+
+    if _skip_cleaning(raw_resume_text):
+        return raw_resume_text
+
+    try:
+        response = client.chat.completions.create(
+            model=CLEAN_MODEL,
+            messages=[
+                {"role": "system", "content": _CLEANING_SYSTEM_PROMPT},
+                {"role": "user", "content": raw_resume_text},
+            ],
+            temperature=0.0,
+            max_tokens=_CLEAN_MAX_TOKENS,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"{CLEAN_ERROR_PREFIX} {e}"
+
+
+def clean_resumes_batch(raw_texts, concurrency=10):
+    """
+    Clean many raw resumes concurrently. Each cleaning call is a
+    multi-second OpenAI round trip and they are independent, so they run
+    on the async client under a semaphore instead of a thread per call —
+    one event loop multiplexes the sockets and the cap keeps in-flight
+    requests inside typical rate-limit tiers. Results come back in the
+    same order as `raw_texts`.
+    """
+    if len(raw_texts) < 2:
+        return [clean_and_structure_resume(t) for t in raw_texts]
+
+    async def _clean_all():
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _clean_one(text):
+            if _skip_cleaning(text):
+                return text
+            async with sem:
+                try:
+                    response = await async_client.chat.completions.create(
+                        model=CLEAN_MODEL,
+                        messages=[
+                            {"role": "system", "content": _CLEANING_SYSTEM_PROMPT},
+                            {"role": "user", "content": text},
+                        ],
+                        temperature=0.0,
+                        max_tokens=_CLEAN_MAX_TOKENS,
+                    )
+                    return response.choices[0].message.content
+                except Exception as e:
+                    return f"{CLEAN_ERROR_PREFIX} {e}"
+
+        return await asyncio.gather(*(_clean_one(t) for t in raw_texts))
+
+    return asyncio.run(_clean_all())
+
+
+# ======================================================
+# 3. EMBEDDINGS + FIT SCORE + RANKING
+# ======================================================
+_EMBEDDING_MODEL = "text-embedding-3-small"
+# The embeddings endpoint takes arrays; sub-batch to stay well inside
+# the per-request limits (2048 inputs / ~300K tokens). 96 resumes of a
+# few thousand tokens each sit comfortably under the token ceiling,
+# which is the binding constraint for this corpus, not the input count.
+_EMBED_BATCH_SIZE = 96
+
+# On-disk cache shared by every embedding call, keyed on a SHA-256 of
+# model + text. Streamlit reruns discard process state, so repeated JDs
+# and resumes would otherwise be re-embedded on every click. Vectors are
+# quantized to int8 with a per-vector absmax scale (stored as a float32
+# header), which is 4x smaller than raw float32 and keeps >0.99 cosine
+# fidelity on these embeddings (float16 would only halve the size for
+# the same read cost). Vectors are dequantized to float32 on load so the
+# GEMV ranking path stays on the fast BLAS kernels.
+_CACHE_DIR = Path(".ats_cache")
+
+# In-process memo in front of the disk layer: hot texts (the JD on every
+# rerun, the semantic-cache keys) skip even the file read + dequantize.
+# Bounded like the semantic cache; eviction is oldest-first, which is
+# fine for a working set this small.
+_EMBED_MEMO_MAX = 512
+_embed_memo = {}
+
+
+def _embedding_cache_path(text):
+    key = hashlib.sha256(
+        (_EMBEDDING_MODEL + "|" + text).encode("utf-8")
+    ).hexdigest()
+    return _CACHE_DIR / "embeddings" / f"{key}.i8"
+
+
+def _embedding_cache_get(text):
+    path = _embedding_cache_path(text)
+    try:
+        if path.exists():
+            data = path.read_bytes()
+            scale = np.frombuffer(data[:4], dtype=np.float32)[0]
+            quantized = np.frombuffer(data[4:], dtype=np.int8)
+            return quantized.astype(np.float32) * scale
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _embedding_cache_set(text, vec):
+    path = _embedding_cache_path(text)
+    scale = float(np.abs(vec).max()) / 127.0 or 1.0
+    quantized = np.round(vec / scale).astype(np.int8)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(np.float32(scale).tobytes() + quantized.tobytes())
+    except OSError:
+        pass
+
+
+def _normalize(v):
+    v = np.asarray(v, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+# The memo is written from the feedback thread pool and asyncio workers
+# alike; the lock keeps the evict-then-insert pair atomic so concurrent
+# writers cannot pop the same key.
+_embed_memo_lock = threading.Lock()
+
+
+def _embed_memo_put(text, vec):
+    with _embed_memo_lock:
+        if len(_embed_memo) >= _EMBED_MEMO_MAX:
+            _embed_memo.pop(next(iter(_embed_memo)))
+        _embed_memo[text] = vec
+
+
+def get_embeddings(texts):
+    """Embed many texts, reading repeats from the in-process/on-disk caches.
+
+    Vectors come back L2-normalized, so every similarity downstream is a
+    plain dot product — no per-call norm recomputation. Cache loads are
+    re-normalized too (idempotent), which also corrects the slight norm
+    drift the int8 quantization introduces.
+    """
+    cleaned = [t.replace("\n", " ") for t in texts]
+    vectors = [None] * len(cleaned)
+    misses = []
+
+    for i, text in enumerate(cleaned):
+        cached = _embed_memo.get(text)
+        if cached is None:
+            cached = _embedding_cache_get(text)
+            if cached is not None:
+                cached = _normalize(cached)
+                _embed_memo_put(text, cached)
+        if cached is not None:
+            vectors[i] = cached
+        else:
+            misses.append(i)
+
+    for start in range(0, len(misses), _EMBED_BATCH_SIZE):
+        batch_idx = misses[start:start + _EMBED_BATCH_SIZE]
+        resp = client.embeddings.create(
+            input=[cleaned[i] for i in batch_idx], model=_EMBEDDING_MODEL
+        )
+        for i, item in zip(batch_idx, resp.data):
+            vec = _normalize(item.embedding)
+            _embedding_cache_set(cleaned[i], vec)
+            _embed_memo_put(cleaned[i], vec)
+            vectors[i] = vec
+
+    return vectors
+
+
+def get_embedding(text):
+    return get_embeddings([text])[0]
+
+
+class SemanticLLMCache:
+    """
+    Semantic cache for LLM completions. Keys are embeddings of the request
+    text; lookups return a stored completion when cosine similarity to a
+    previous key reaches the threshold, so near-identical JD/resume pairs
+    (e.g. HR re-opening the same candidate after a small JD tweak) skip
+    the gpt-4o call. Embeddings go through the disk-cached OpenAI path, so
+    repeat lookups cost a cache read rather than a model load; a local
+    embedding model (MiniLM via ONNX Runtime) was considered but would
+    add a ~90 MB download and a tokenizer stack for no extra cache hits,
+    since keys are already served from the int8 disk cache after the
+    first sighting.
+    """
+
+    def __init__(self, threshold=0.87, max_entries=256):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._keys = None  # (K, D) float32, rows L2-normalised
+        self._values = []
+        # The cache is hit from the batch-feedback thread pool and from
+        # asyncio.to_thread; the lock keeps _keys and _values in step so
+        # a lookup can never pair one candidate's key with another's
+        # feedback.
+        self._lock = threading.Lock()
+
+    # Keys are capped well under the embedding model's 8192-token input
+    # limit (~4 chars/token) — JD+resume pairs routinely run past it and
+    # the endpoint rejects oversized inputs outright. Truncation only
+    # blurs the tail of the longest pairs, which the similarity
+    # threshold tolerates.
+    _KEY_MAX_CHARS = 24000
+
+    @classmethod
+    def _embed_key(cls, text):
+        # get_embedding already returns L2-normalized float32.
+        return get_embedding(text[:cls._KEY_MAX_CHARS])
+
+    def get(self, text):
+        if not self._values:
+            return None
+        try:
+            query = self._embed_key(text)
+        except Exception:
+            # An embedding failure is a cache miss, not a reason to fail
+            # the caller's request.
+            return None
+        with self._lock:
+            if not self._values:
+                return None
+            sims = self._keys @ query
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return self._values[best]
+        return None
+
+    def put(self, text, value):
+        try:
+            query = self._embed_key(text)
+        except Exception:
+            # Never let a failed cache insert discard the generation the
+            # caller just paid for.
+            return
+        with self._lock:
+            if self._keys is None:
+                self._keys = query[None, :]
+            else:
+                self._keys = np.vstack([self._keys, query])[-self.max_entries:]
+            self._values = (self._values + [value])[-self.max_entries:]
+
+
+# Shared across the recruiter feedback and rejection-email generators.
+semantic_cache = SemanticLLMCache()
+
+
+def compute_fit_score(job_description: str, resume_text: str, jd_vec=None) -> float:
+    # Callers that already hold the JD embedding (e.g. a session-cached
+    # vector in the UI) pass it in to skip re-embedding the same JD.
+    if jd_vec is None:
+        jd_vec = get_embedding(job_description)
+    res_vec = get_embedding(resume_text)
+    # Embeddings are normalized at ingest, so cosine is a plain dot.
+    return float(np.asarray(jd_vec, dtype=np.float32) @ res_vec)
+
+
+# Below this pool size the GEMV beats FAISS once index-build cost is
+# counted, so the optional backend only engages for big batches.
+_FAISS_MIN_CANDIDATES = 512
+
+
+def rank_candidates(job_description, candidates_data, jd_vec=None):
+    if not candidates_data:
+        return []
+
+    # One embeddings request covers the JD and every resume, instead of
+    # paying a network round trip per candidate. A precomputed JD vector
+    # drops the JD from the batch entirely.
+    if jd_vec is None:
+        vectors = get_embeddings(
+            [job_description] + [c["resume"] for c in candidates_data]
+        )
+        jd_vec = vectors[0]
+        resume_vectors = vectors[1:]
+    else:
+        resume_vectors = get_embeddings([c["resume"] for c in candidates_data])
+
+    # Stack the vectors and score every candidate with one BLAS
+    # matrix-vector product instead of a per-candidate cosine call.
+    # Rows arrive unit-length from get_embeddings, so no norm pass here.
+    resume_matrix = np.asarray(resume_vectors, dtype=np.float32)
+    jd = np.asarray(jd_vec, dtype=np.float32)
+
+    if faiss is not None and len(candidates_data) >= _FAISS_MIN_CANDIDATES:
+        # Exact inner-product search through FAISS's SIMD kernels; on
+        # normalized vectors this is the same cosine ranking, already
+        # sorted best-first.
+        index = faiss.IndexFlatIP(resume_matrix.shape[1])
+        index.add(resume_matrix)
+        ordered_scores, order = index.search(jd[None, :], len(candidates_data))
+        ordered_scores, order = ordered_scores[0], order[0]
+    else:
+        # argsort on the raw scores keeps the ordering work in numpy;
+        # the result dicts are then built directly in rank order.
+        scores = resume_matrix @ jd
+        order = np.argsort(-scores)
+        ordered_scores = scores[order]
+
+    return [
+        {
+            "name": candidates_data[i]["name"],
+            "score": float(score),
+            "resume": candidates_data[i]["resume"],
+        }
+        for i, score in zip(order, ordered_scores)
+    ]
+
+
+# ======================================================
+# 4. FEEDBACK COMPLIANCE CHECKER
+# ======================================================
+
+# Optional fast multi-pattern matchers, best first: Hyperscan (SIMD DFA),
+# then pyahocorasick, then the compiled regex alternation.
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class FeedbackComplianceChecker:
+    """
+    Deterministic guardrail that scans LLM-generated feedback for prohibited
+    (protected-trait or personality-based) language before it reaches HR.
+    Uses an Aho-Corasick automaton so the text is walked once for all terms,
+    falling back to a single compiled regex alternation when pyahocorasick
+    is not installed.
+    """
+
+    _HIGH_SEVERITY = frozenset({
+        "age", "gender", "disability", "race", "religion",
+        "pregnant", "family", "married", "children",
+    })
+
+    # Term data is deduplicated, frozen and sorted once at class creation;
+    # every checker instance shares it instead of carrying its own copies.
+    prohibited_terms = frozenset({
+        # Protected characteristics
+        "age", "old", "young", "elderly", "gender", "male", "female",
+        "man", "woman", "pregnant", "pregnancy", "maternity", "paternity",
+        "married", "single", "divorced", "children", "kids", "family",
+        "race", "racial", "ethnicity", "ethnic", "nationality", "religion",
+        "religious", "disability", "disabled", "handicap", "illness",
+        "health", "medical", "sexual orientation", "gay", "lesbian",
+        "transgender", "citizenship", "immigrant", "accent", "native",
+        # Appearance / personal life
+        "appearance", "attractive", "weight", "overweight", "height",
+        # Personality and soft-skill judgements
+        "personality", "attitude", "culture fit", "cultural fit",
+        "soft skills", "likeable", "friendly", "energetic", "enthusiastic",
+        "mature", "immature", "emotional", "temperament", "demeanor",
+        "charisma", "team player",
+    })
+    _PROHIBITED_SORTED = tuple(sorted(prohibited_terms, key=len, reverse=True))
+
+    # Phrases in which a prohibited term is legitimately job-related.
+    allowed_contexts = {
+        "age": ["years of experience", "average", "coverage", "language",
+                "manage", "management", "percentage", "leverage", "storage"],
+        "native": ["native code", "cloud native", "native mobile",
+                   "react native"],
+        "health": ["healthcare industry", "healthcare sector",
+                   "public health experience"],
+        "family": ["product family"],
+        "single": ["single sign-on", "single source of truth",
+                   "single page application"],
+        "male": ["email"],
+        "man": ["management", "manager", "manual", "demand", "command",
+                "performance"],
+        "old": ["bold", "folder", "threshold", "stakeholder"],
+        "race": ["trace"],
+    }
+    _allowed_phrases = tuple(p for v in allowed_contexts.values() for p in v)
+    _ALLOWED_SORTED = tuple(sorted(_allowed_phrases, key=len, reverse=True))
+
+    def __init__(self):
+        # One precompiled word-bounded alternation so "age" never fires on
+        # "manage" or "page". Longest alternatives first so multi-word terms
+        # win over their single-word prefixes.
+        self._pattern = re.compile(
+            r"\b(?:" + "|".join(map(re.escape, self._PROHIBITED_SORTED)) + r")\b",
+            re.IGNORECASE,
+        )
+        # Allowed-context phrases are blanked out of the text before the
+        # prohibited scan, replacing the old nested phrase loop.
+        self._allowed_pat = re.compile(
+            "|".join(map(re.escape, self._ALLOWED_SORTED)), re.IGNORECASE
+        )
+
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for term in self.prohibited_terms:
+                self._automaton.add_word(term, term)
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+
+        self._hs_db = None
+        self._hs_terms = ()
+        if hyperscan is not None:
+            try:
+                terms = self._PROHIBITED_SORTED
+                db = hyperscan.Database()
+                db.compile(
+                    expressions=[re.escape(t).encode() for t in terms],
+                    ids=list(range(len(terms))),
+                    flags=[
+                        hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST
+                    ]
+                    * len(terms),
+                )
+                self._hs_db = db
+                self._hs_terms = tuple(terms)
+            except Exception:
+                self._hs_db = None
+
+    @staticmethod
+    def _covered(start, end, allowed_spans):
+        """True when [start, end) lies inside any allowed-context span."""
+        return any(a <= start and end <= b for a, b in allowed_spans)
+
+    @staticmethod
+    def _on_word_boundary(text, start, end):
+        """True when text[start:end] is not embedded in a larger word."""
+        if start > 0 and (text[start - 1].isalnum() or text[start - 1] == "_"):
+            return False
+        if end < len(text) and (text[end].isalnum() or text[end] == "_"):
+            return False
+        return True
+
+    def check_compliance(self, feedback_text):
+        """Scan feedback once and report prohibited terms found."""
+        # Locate allowed-context spans in one linear pass, then collect
+        # prohibited-term hits over the original text and suppress any hit
+        # whose offsets fall inside a whitelisted span. Unlike blanking the
+        # phrases out with .sub(), this allocates no modified copy and
+        # keeps all offsets aligned with the input. Case folding is done
+        # by the matchers (IGNORECASE / HS_FLAG_CASELESS).
+        allowed_spans = [m.span() for m in self._allowed_pat.finditer(feedback_text)]
+
+        # Hyperscan scans the UTF-8 bytes, so its offsets are byte
+        # positions; they only line up with the str (and with
+        # allowed_spans) when the text is pure ASCII. gpt-4o routinely
+        # emits curly quotes and dashes, so anything else takes the
+        # automaton/regex backends, whose offsets are character-based.
+        if self._hs_db is not None and feedback_text.isascii():
+            hits = set()
+
+            def on_match(term_id, start, end, flags, context=None):
+                if self._on_word_boundary(
+                    feedback_text, start, end
+                ) and not self._covered(start, end, allowed_spans):
+                    hits.add(self._hs_terms[term_id])
+                return 0
+
+            self._hs_db.scan(feedback_text.encode(), match_event_handler=on_match)
+            violations = hits
+        elif self._automaton is not None:
+            # pyahocorasick has no caseless mode; this backend still pays
+            # for one downcased copy.
+            lowered = feedback_text.lower()
+            violations = {
+                term
+                for end, term in self._automaton.iter(lowered)
+                if self._on_word_boundary(lowered, end - len(term) + 1, end + 1)
+                and not self._covered(end - len(term) + 1, end + 1, allowed_spans)
+            }
+        else:
+            violations = {
+                m.group(0).lower()
+                for m in self._pattern.finditer(feedback_text)
+                if not self._covered(m.start(), m.end(), allowed_spans)
+            }
+
+        if self._HIGH_SEVERITY.intersection(violations):
+            severity = "high"
+        elif violations:
+            severity = "low"
+        else:
+            severity = "none"
+
+        return {
+            "compliant": not violations,
+            "violations": sorted(violations),
+            "severity": severity,
+        }
+
+    def sanitize_feedback(self, feedback_text):
+        """Strip lines that still contain prohibited terms (last resort)."""
+        pat = self._pattern
+        sanitized_lines = [
+            line if not pat.search(line) else "<!-- Line removed for compliance -->"
+            for line in feedback_text.split("\n")
+        ]
+        return "\n".join(sanitized_lines)
+
+
+# Shared checker instance: the automaton and compiled patterns are
+# read-only after construction, so one instance can serve every call
+# instead of rebuilding the matcher per feedback request.
+_CHECKER = FeedbackComplianceChecker()
+
+
+# ======================================================
+# 5. FEEDBACK ENGINE
+# ======================================================
+
+# Disk-backed cache for LLM feedback, keyed by a hash of everything that
+# influences the output. Re-running with an unchanged JD + resume becomes
+# a file read instead of a multi-second API call.
+
+
+# Output-token budgeting: recruiter rejections typically land around 300
+# tokens, so a fixed worst-case ceiling makes every call pay 3x typical
+# latency headroom. Completion sizes are logged and the p95 (plus 20%)
+# becomes the ceiling once enough samples exist.
+_DEFAULT_FEEDBACK_MAX_TOKENS = 500
+_MIN_FEEDBACK_MAX_TOKENS = 300
+_feedback_budget = None
+
+
+def _record_completion_tokens(usage):
+    if usage is None:
+        return
+    try:
+        path = _CACHE_DIR / "token_hist.jsonl"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as fh:
+            fh.write(
+                json.dumps({"completion_tokens": usage.completion_tokens}) + "\n"
+            )
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+def _feedback_max_tokens():
+    """max_tokens for feedback calls: observed p95 * 1.2, floored at 300."""
+    global _feedback_budget
+    if _feedback_budget is not None:
+        return _feedback_budget
+
+    budget = _DEFAULT_FEEDBACK_MAX_TOKENS
+    try:
+        lines = (_CACHE_DIR / "token_hist.jsonl").read_text(encoding="utf-8")
+        samples = sorted(
+            json.loads(line)["completion_tokens"]
+            for line in lines.splitlines()
+            if line.strip()
+        )
+        if len(samples) >= 20:
+            p95 = samples[int(0.95 * (len(samples) - 1))]
+            budget = max(_MIN_FEEDBACK_MAX_TOKENS, int(p95 * 1.2))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    _feedback_budget = budget
+    return budget
+
+
+def _feedback_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _feedback_cache_get(key):
+    path = _CACHE_DIR / "feedback" / f"{key}.txt"
+    try:
+        if path.exists():
+            return path.read_text(encoding="utf-8")
+    except OSError:
+        pass
+    return None
+
+
+def _feedback_cache_set(key, value):
+    path = _CACHE_DIR / "feedback" / f"{key}.txt"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(value, encoding="utf-8")
+    except OSError:
+        pass
+_RECRUITER_SYSTEM_PROMPT = """
+You are a Compliance Resume Consultant. Provide lawful, hard-skill-focused feedback only.
+Do not mention personality, attitude, culture fit, or any protected characteristic.
+"""
+
+_RETRY_ADDENDUM = (
+    "\n\nIMPORTANT: Previous attempt included prohibited terms: {violations}. "
+    "Do not use them."
+)
+
+# Cheap lexical pre-filter: when a resume shares almost no keywords with
+# the JD, a templated rejection is returned instead of spending an LLM
+# call on a candidate the ranking already placed at the bottom.
+_STOPWORDS = frozenset({
+    "and", "the", "for", "with", "you", "your", "our", "are", "will",
+    "have", "has", "this", "that", "from", "must", "should", "able",
+    "work", "working", "experience", "years", "strong", "skills",
+    "knowledge", "ability", "team", "role", "job", "candidate",
+    "responsibilities", "requirements", "preferred", "plus",
+})
+
+_LOW_FIT_TEMPLATE = """Subject: Feedback on Your Application
+
+Thank you for applying. After reviewing your application against the job
+description, we will not be moving forward at this time. The role requires
+skills and experience that are not yet demonstrated in your resume. We
+encourage you to apply again once your experience is closer to the posted
+requirements.
+
+HR Team"""
+
+
+def _keywords(text):
+    """Lowercased word tokens minus stopwords, for cheap overlap checks."""
+    # The pattern keeps interior dots for tokens like node.js, but that
+    # also captures sentence-final punctuation ("certification.") which
+    # would never intersect the other side; strip trailing dots before
+    # the stopword filter so both run on the same form.
+    return {
+        token
+        for token in (
+            match.rstrip(".")
+            for match in re.findall(r"[a-z][a-z0-9+#.]{2,}", text.lower())
+        )
+        if token not in _STOPWORDS
+    }
+
+
+def generate_compliant_feedback(
+    job_description, candidate_resume, min_keyword_overlap=0.1
+):
+    """Generate legally compliant rejection feedback."""
+
+    user_prompt = f"""
+    JOB DESCRIPTION:
+    {job_description}
+
+    RESUME:
+    {candidate_resume}
+    """
+
+    cache_key = _feedback_cache_key(
+        _RECRUITER_SYSTEM_PROMPT, job_description, candidate_resume, "gpt-4o"
+    )
+    cached = _feedback_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    semantic_key = f"recruiter-feedback|{job_description}\n\n{candidate_resume}"
+    cached = semantic_cache.get(semantic_key)
+    if cached is not None:
+        return cached
+
+    # Short-circuit candidates with near-zero keyword overlap: the LLM
+    # would only restate that nothing matches, so use the canned template.
+    jd_keywords = _keywords(job_description)
+    if jd_keywords:
+        overlap = len(jd_keywords & _keywords(candidate_resume)) / len(jd_keywords)
+        if overlap < min_keyword_overlap:
+            return _LOW_FIT_TEMPLATE
+
+    checker = _CHECKER
+    feedback = ""
+    violations = None
+
+    for attempt in range(3):
+        # Build the retry note fresh from the base prompt each attempt so
+        # addenda never stack across retries and grow the input.
+        system_for_call = _RECRUITER_SYSTEM_PROMPT
+        if violations:
+            system_for_call += _RETRY_ADDENDUM.format(violations=", ".join(violations))
+
+        try:
+            stream = client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": system_for_call},
+                    {"role": "user", "content": user_prompt},
+                ],
+                stream=True,
+                stream_options={"include_usage": True},
+                max_tokens=_feedback_max_tokens(),
+            )
+        except Exception as e:
+            return f"Error: {e}"
+
+        # Accumulate the stream and check compliance on the buffer
+        # periodically, so a generation that goes off the rails is cut
+        # short instead of paying for the full completion before retrying.
+        feedback = ""
+        aborted = False
+        chunks_since_check = 0
+        for chunk in stream:
+            if not chunk.choices:
+                _record_completion_tokens(getattr(chunk, "usage", None))
+                continue
+            feedback += chunk.choices[0].delta.content or ""
+            chunks_since_check += 1
+            if chunks_since_check >= 32:
+                chunks_since_check = 0
+                partial_result = checker.check_compliance(feedback)
+                if partial_result["severity"] == "high":
+                    stream.close()
+                    compliance_result = partial_result
+                    aborted = True
+                    break
+
+        if not aborted:
+            compliance_result = checker.check_compliance(feedback)
+            if compliance_result["compliant"]:
+                _feedback_cache_set(cache_key, feedback)
+                semantic_cache.put(semantic_key, feedback)
+                return feedback
+
+        violations = compliance_result["violations"]
+
+    # All retries exhausted: fall back to stripping offending lines.
+    return checker.sanitize_feedback(feedback)
+
+
+_APPLICANT_SYSTEM_PROMPT = """
+You are an expert ATS Coach. Produce a concise Markdown bullet list of
+concrete, job-related improvements the applicant can make to better match
+the job description. Refer only to hard skills, tools, and demonstrable
+experience — never personality, culture fit, or protected characteristics.
+"""
+
+
+def generate_applicant_list_feedback(job_description, cleaned_resume):
+    """Generate an actionable improvement list for the applicant view."""
+    system_prompt = _APPLICANT_SYSTEM_PROMPT
+
+    user_prompt = f"""
+    JOB DESCRIPTION:
+    {job_description}
+
+    RESUME:
+    {cleaned_resume}
+    """
+
+    cache_key = _feedback_cache_key(
+        system_prompt, job_description, cleaned_resume, "gpt-4o", 0.2
+    )
+    cached = _feedback_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.2,
+            max_tokens=1000,  # improvement lists run longer than rejections
+        )
+        feedback = response.choices[0].message.content
+        _feedback_cache_set(cache_key, feedback)
+        return feedback
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def generate_feedback_pair(job_description, cleaned_resume):
+    """
+    Run recruiter and applicant feedback generation concurrently.
+    Both are network-bound OpenAI round trips, so overlapping them roughly
+    halves wall-clock time when a candidate needs both kinds of feedback.
+    """
+
+    async def _gather():
+        return await asyncio.gather(
+            asyncio.to_thread(
+                generate_compliant_feedback, job_description, cleaned_resume
+            ),
+            asyncio.to_thread(
+                generate_applicant_list_feedback, job_description, cleaned_resume
+            ),
+        )
+
+    recruiter_feedback, applicant_feedback = asyncio.run(_gather())
+    return recruiter_feedback, applicant_feedback
+
+
+def batch_generate_compliant_feedback(
+    job_description, resumes, max_workers=8, progress_callback=None
+):
+    """
+    Generate compliant feedback for many cleaned resumes concurrently.
+    Each call is a multi-second network round trip, so a thread pool turns
+    the sum of latencies into roughly the max. Results come back in the
+    same order as `resumes`; `progress_callback(done, total)` is invoked
+    as each one completes (e.g. to drive st.progress).
+    """
+    results = [None] * len(resumes)
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(generate_compliant_feedback, job_description, resume): i
+            for i, resume in enumerate(resumes)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            done += 1
+            if progress_callback is not None:
+                progress_callback(done, len(resumes))
+
+    return results
+
+
+# ======================================================
+# 6. RESUME REWRITE ENGINE
+# ======================================================
+_REWRITE_SYSTEM_PROMPT = """
+You are an expert ATS Resume Writer. Maintain truth, improve clarity,
+rephrase bullets, strengthen relevance, but do not invent experience.
+Output in Markdown.
+"""
+
+
+def rewrite_resume(job_description: str, resume_text: str) -> str:
+    """Rewrite resume for better alignment while staying truthful."""
+
+    prompt = f"""
+    JOB DESCRIPTION:
+    {job_description}
+
+    ORIGINAL RESUME:
+    {resume_text}
+
+    Rewrite the resume and then list what changed and why.
+    """
+
+    try:
+        res = client.chat.completions.create(
+            model=REWRITE_MODEL,
+            messages=[
+                {"role": "system", "content": _REWRITE_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.4,
+        )
+        return res.choices[0].message.content
+    except Exception as e:
+        return f"Error during rewrite: {e}"